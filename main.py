@@ -30,11 +30,9 @@ if __name__ == '__main__':
     if alg.optimalAssignment:
         print(f'Algorithm Congifuration:\n\tMCV: {mcv}\n\tAC3: {ac3}')
         print('Found Optimal Assignment:')
-        grid = []
-        for i in range(1, sudoku.get_size()+1):
-            grid.append([])
-            for j in range(1, sudoku.get_size()+1):
-                grid[i-1].append(alg.optimalAssignment[(i,j)])
+        size = sudoku.get_size()
+        grid = [[alg.optimalAssignment[(i, j)] for j in range(1, size+1)]
+                for i in range(1, size+1)]
         for row in grid:
             print(row)
     else:
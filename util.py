@@ -1,352 +1,576 @@
-import copy
-
-##############################################################################
-class CSP:
-    """
-    A class to represent a weighted CSP (Constrained Satisfaction Problem).
-
-    """
-    def __init__(self):
-        # number of variables in the CSP
-        self.numVariables = 0
-        # a list containing the name of the variables
-        self.variables = []
-        # a dict for storing the domain values for each of the variables.
-        # key=variable name, value=list of domain values that the variable
-        # can take.
-        self.values = {}
-
-        # a dict to hold the unary factors of the variables.
-        # self.unaryFactors[var] will hold a factor table (python dict)
-        # representing the weight distribution of the variables values
-        # self.unaryFactors[var][val] = weight of value val for variable var
-        # when more than one factor applies, they are 'aggregated' using
-        # element-wise multiplication
-        self.unaryFactors = {}
-
-        # a dict containing the information about the cross-weight of val1
-        # of var1 and val2 of var2.
-        # self.binaryFactors[var1][var2][val1][val2] = weight of assigning
-        # var1 the value val1 and var2 the value val2
-        self.binaryFactors = {}
-
-    def add_variable(self, var, domain):
-        """
-        Add a new variable to the CSP
-        """
-
-        if var in self.variables:
-            raise Exception(f"Variable name already exists: {str(var)}")
-
-        self.numVariables += 1
-        self.variables.append(var)
-        self.values[var] = domain
-        self.binaryFactors[var] = {}
-
-    def get_neighbor_variables(self, var):
-        """
-        Returns a list of neighboring variables to variable var according to
-        the factor graph described through binaryFactors.
-        """
-        return list(self.binaryFactors[var].keys())
-
-    def add_unary_factor(self, var, factor_func):
-        """
-        Add a unary factor to variable var according to function
-        factor_func(val) for every value val in var's domain.
-        If variable var already have a unary factor, the two functions will
-        be merged using element-wise multiplication.
-        """
-        factor = {val: factor_func(val) for val in self.values[var]}
-
-        # if self.unaryFactors[var] is None:
-        if var not in self.unaryFactors:
-            self.unaryFactors[var] = factor
-        else:
-            # if there's already a unary factor for that variable, add by
-            # element-wise multiplication
-            self.unaryFactors[var] = {val: self.unaryFactors[var][val] *
-                                           factor[val] for val in factor}
-
-    def add_binary_factor(self, var1, var2, factor_func):
-        """
-        Add a binary factor for the variables var1 and var2 according to
-        function factor_func(val1, val2).
-        If the two variables already have a binary factor between them,
-        the two factors will be merged using element-wise multiplication.
-        """
-        if var1 == var2:
-            raise Exception(
-                f"Error: trying to add a binary factor with the same "
-                f"variable {va1r}")
-
-        newTable1 = {val1: {val2: factor_func(val1, val2)
-                            for val2 in self.values[var2]
-                            }
-                     for val1 in self.values[var1]
-                     }
-        self._update_binary_factor_table(var1, var2, newTable1)
-
-        newTable2 = {val2: {val1: factor_func(val2, val1)
-                            for val1 in self.values[var1]
-                            }
-                     for val2 in self.values[var2]
-                     }
-        self._update_binary_factor_table(var2, var1, newTable2)
-
-    def _update_binary_factor_table(self, var1, var2, table):
-        """
-        Internal helper function.
-        Updates the binary factor table according to the new factor function.
-        If variables already 'neighbors', add the new factor using element-wise
-        multiplication.
-        """
-
-        if var2 not in self.binaryFactors[var1]:
-            self.binaryFactors[var1][var2] = table
-
-        else:
-            for v1 in table:
-                for v2 in table[v1]:
-                    assert v1 in self.binaryFactors[var1][var2]
-                    assert v2 in self.binaryFactors[var1][var2][v1]
-                    self.binaryFactors[var1][var2][v1][v2] *= table[v1][v2]
-
-##############################################################################
-class Backtracking:
-    """
-    A backtracking algorithm for solving weighted CSP.
-    Using Most Constraint Variable (MCV) heuristic and/or Arc Consistency
-    enforcement (AC3 algorithm) as option.
-
-    Usage:
-    alg = Backtracking()
-    alg.solve(mcv=True, ac3=True)
-    alg.print_stats()
-
-    optimalAssignment = alg.optimalAssignment
-    """
-    def reset_results(self):
-        """
-        Keep track of various statistics of the CSP solver.
-        Kind of __init__(), but can be 'recalled' to enable repeated solver
-        calls.
-        """
-        self.numOptimalAssignments = 0
-        self.optimalWeight = 0
-        self.optimalAssignment = {}
-
-        self.numAssignments = 0
-
-        # keep track of number of calls to self.backtrack() to compare
-        # complexity when using mcv/ac3.
-        self.numOperations = 0
-
-        self.firstAssignmentNumOperations = 0
-
-        self.allAssignments = []
-
-    def print_stats(self):
-
-        if self.optimalAssignment:
-            print(f"Found {self.numOptimalAssignments} optimal assignments "
-                  f"with weight {self.optimalWeight} in {self.numOperations} "
-                  f"operations")
-            print(f"First assignment took "
-                  f"{self.firstAssignmentNumOperations} operations")
-        else:
-            print("No solution was found")
-
-    def get_delta_weight(self, assignment, var, val):
-        """
-        given a partial assignment and a proposed variable var with value
-        val, return the marginal weight expanding the assignment with
-        variable var with value val.
-        :param assignment: a dict containing the previously assigned
-        variables and their values. (key=variable name, value=assigned value)
-        :param var: name of proposed variable to be assigned.
-        :param val: value to be assigned to variable var
-        :return: the marginal factor to be multiplied by current assignment
-        total weight when expanding it to include variable var with value val.
-        """
-        # make sure variable var not already in assignment
-        assert var not in assignment
-
-        w = 1.0
-        if var in self.csp.unaryFactors.keys():
-            w *= self.csp.unaryFactors[var][val]
-            if w == 0: return 0
-        for var2, factor in self.csp.binaryFactors[var].items():
-            if var2 not in assignment: continue
-            val2 = assignment[var2]
-            # cumulative weight with all assigned variables
-            w *= factor[val][val2]
-            # return the first time we see in-alignment with other assigned
-            # variables
-            if w == 0: return 0
-
-        return w
-
-    def solve(self, csp, mcv=True, ac3=True):
-        """
-        Solves the given weighted CSP using optional heuristics (mcv / ac3).
-        This function will keep searching for satisfied assignments (for
-        enabling the 'weighted CSP'.
-        Results are stored the initialization (/reset_results) variables.
-
-        :param csp: A weighted CSP
-        :param mcv: True for using the Most Constraint Variable heuristic.
-        :param ac3: True for applying arc-consistency (AC-3).
-        """
-        self.csp = csp
-        self.mcv = mcv
-        self.ac3 = ac3
-        self.reset_results()
-
-        self.domains = {var: list(self.csp.values[var])
-                        for var in self.csp.variables
-                        }
-
-        self.backtrack({}, 1)
-
-    def backtrack(self, assignment, weight):
-        """
-        Preforming the backtracking algorithm to find all valid assignments
-        to the factor graph (weigted CSP).
-
-        :param assignment: A dict of current assignment. Entries include
-        only assigned variables. key= name of assigned variable; value=
-        assigned value to the variable
-        :param weight: The weight of the given assignment. To be updated
-        with get_delta_weight().
-        :return:
-        """
-        self.numOperations += 1
-
-        # first, handle complete assignment
-        if len(assignment) == self.csp.numVariables:
-            # final assignment
-            self.numAssignments += 1
-            newAssignment = {var: assignment[var] for var in
-                             self.csp.variables}
-            self.allAssignments.append(newAssignment)
-
-            # update statistics
-            if self.numOptimalAssignments == 0 or weight > self.optimalWeight:
-                if weight == self.optimalWeight:
-                    self.numOptimalAssignments += 1
-                else:
-                    self.numOptimalAssignments = 1
-                self.optimalWeight = weight
-
-                self.optimalAssignment = newAssignment
-                if self.firstAssignmentNumOperations == 0:
-                    self.firstAssignmentNumOperations = self.numOperations
-
-            return
-
-        # if partial assignment, get next variable. The first unassigned if
-        # mcv is disables.
-        var = self.get_unassigned_variable(assignment)
-        values = self.domains[var]
-
-        for val in values:
-            deltaWeight = self.get_delta_weight(assignment, var, val)
-            if deltaWeight > 0:
-                assignment[var] = val
-
-                if self.ac3:
-                    # perform arc-consistency check
-
-                    # keep original copy of domains (ac-3 alters domain when
-                    # 'checking')
-                    domainsCopy = copy.deepcopy(self.domains)
-
-                    # temporary update domains of variable var to the
-                    # proposed value val
-                    self.domains[var] = [val]
-
-                    # enforce arc-consistency on neighbors (and their
-                    # neighbors, etc (updating self.domains in the process,
-                    # hopefully shrinking number of possible values to
-                    # unassigned variables.
-                    self.arc_consistency(var)
-
-                    # recursively call backtrack on possible children
-                    self.backtrack(assignment, weight * deltaWeight)
-
-                    # restore unassigned variables' domain
-                    self.domains = domainsCopy
-
-                else:
-                    # arc consistency is disabled
-                    self.backtrack(assignment, weight * deltaWeight)
-
-                del assignment[var]
-
-    def get_unassigned_variable(self, assignment):
-        """
-        Given a partial assignment, return a variable to be assigned next.
-
-        In case of mcv enabled (=True), count number of possible valid values
-        of each of the variables (among those that are consistent with
-        current assignment-- weight>0) and return the variable with the
-        least number of these values.
-        """
-        if self.mcv:
-            result = []
-
-            for var in self.csp.variables:
-                if var not in assignment:
-                    count = sum(self.get_delta_weight(assignment, var,
-                                                      val) != 0
-                                for val in self.domains[var]
-                                )
-                    result.append((count, var))
-
-            return min(result, key=lambda t: t[0])[1]
-
-        else:
-            for var in self.csp.variables:
-                if var not in assignment:
-                    return var
-
-    def arc_consistency(self, var):
-        """
-        Apply arc consistency on the neighbors of variable var.
-        Note variable var is already assigned a value.
-
-        Using a queue, each of the variables with updated domain (with some
-        values being removed), the algorithm runs as deep as possible to
-        enforce the constraint.
-        """
-        queue = [var]
-
-        while queue:
-            var1 = queue.pop(0)
-            neighbors = self.csp.get_neighbor_variables(var1)
-
-            for var2 in neighbors:
-                inconsistent = []
-                for val2 in self.domains[var2]:
-                    CONSISTENT = False
-                    # find a consistent value in var1's domain with val2
-                    for val1 in self.domains[var1]:
-                        if self.csp.binaryFactors[var1][var2][val1][val2] != 0:
-                            CONSISTENT = True
-                            break
-
-                    if not CONSISTENT:
-                        # do not alter domains until end of the for loop (
-                        # for not messing-up with the condition)
-                        inconsistent.append(val2)
-
-                if inconsistent:
-                    # remove inconsistent values from domain
-                    for val2 in inconsistent:
-                        self.domains[var2].remove(val2)
-
-                    # since the domain of var2 has changed, add to queue for
-                    # further exploration of consistency changes
-                    queue.append(var2)
-
+from collections import deque
+
+##############################################################################
+def iter_mask_values(mask):
+    """
+    Iterate over the values encoded in a domain bitmask, lowest value first.
+    Bit v of the mask is set iff value v is in the domain.
+    """
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask &= mask - 1
+
+##############################################################################
+class CSP:
+    """
+    A class to represent a weighted CSP (Constrained Satisfaction Problem).
+
+    """
+    def __init__(self):
+        # number of variables in the CSP
+        self.numVariables = 0
+        # a list containing the name of the variables
+        self.variables = []
+        # a dict mapping each variable name to its dense int index (its
+        # position in self.variables) -- the solver works on indices
+        self.varIndex = {}
+        # a dict for storing the domain values for each of the variables.
+        # key=variable name, value=bitmask of the domain values that the
+        # variable can take (bit v set iff value v is in the domain).
+        self.values = {}
+
+        # a dict to hold the unary factors of the variables.
+        # self.unaryFactors[var] will hold a factor table (python dict)
+        # representing the weight distribution of the variables values
+        # self.unaryFactors[var][val] = weight of value val for variable var
+        # when more than one factor applies, they are 'aggregated' using
+        # element-wise multiplication
+        self.unaryFactors = {}
+
+        # a dict containing the compatibility information between val1 of
+        # var1 and val2 of var2.
+        # self.binaryFactors[var1][var2] is a compatibility table: a list
+        # indexed by val1 whose entries are bitmasks of the var2 values
+        # compatible with var1=val1 (factor weight != 0). The special
+        # entry None stands for the implicit 'not equal' factor (see
+        # add_not_equal_factor).
+        self.binaryFactors = {}
+
+        # a list of units: groups of variables that must take pairwise
+        # different values (e.g. a Sudoku row/column/box). Units enable
+        # hidden-single propagation in the solver.
+        self.units = []
+
+    def add_variable(self, var, domain):
+        """
+        Add a new variable to the CSP.
+        domain is an iterable of the (non-negative integer) values the
+        variable can take; it is stored internally as a bitmask.
+        """
+
+        if var in self.variables:
+            raise Exception(f"Variable name already exists: {str(var)}")
+
+        mask = 0
+        for val in domain:
+            mask |= 1 << val
+
+        self.varIndex[var] = self.numVariables
+        self.numVariables += 1
+        self.variables.append(var)
+        self.values[var] = mask
+        self.binaryFactors[var] = {}
+
+    def get_neighbor_variables(self, var):
+        """
+        Returns a list of neighboring variables to variable var according to
+        the factor graph described through binaryFactors.
+        """
+        return list(self.binaryFactors[var].keys())
+
+    def add_unary_factor(self, var, factor_func):
+        """
+        Add a unary factor to variable var according to function
+        factor_func(val) for every value val in var's domain.
+        If variable var already have a unary factor, the two functions will
+        be merged using element-wise multiplication.
+        """
+        factor = {val: factor_func(val)
+                  for val in iter_mask_values(self.values[var])}
+
+        # if self.unaryFactors[var] is None:
+        if var not in self.unaryFactors:
+            self.unaryFactors[var] = factor
+        else:
+            # if there's already a unary factor for that variable, add by
+            # element-wise multiplication
+            self.unaryFactors[var] = {val: self.unaryFactors[var][val] *
+                                           factor[val] for val in factor}
+
+    def pin(self, var, value):
+        """
+        Pin variable var to a single value by collapsing its domain to it.
+        Equivalent to -- but much cheaper than -- adding the unary
+        equality factor lambda x: x == value: no factor table is built
+        and the solver's unary-weight branch never runs for var.
+        """
+        if not (self.values[var] >> value) & 1:
+            raise Exception(
+                f"Error: trying to pin variable {var} to value {value}, "
+                f"which is outside its domain")
+
+        self.values[var] = 1 << value
+
+    def add_binary_factor(self, var1, var2, factor_func):
+        """
+        Add a binary factor for the variables var1 and var2 according to
+        function factor_func(val1, val2). Only the support structure of the
+        factor is kept: value pairs with factor_func != 0 are compatible.
+        If the two variables already have a binary factor between them,
+        the two factors will be merged (intersection of compatible pairs).
+        """
+        if var1 == var2:
+            raise Exception(
+                f"Error: trying to add a binary factor with the same "
+                f"variable {var1}")
+
+        size1 = self.values[var1].bit_length()
+        size2 = self.values[var2].bit_length()
+
+        newTable1 = [0] * size1
+        newTable2 = [0] * size2
+        for val1 in iter_mask_values(self.values[var1]):
+            for val2 in iter_mask_values(self.values[var2]):
+                if factor_func(val1, val2) != 0:
+                    newTable1[val1] |= 1 << val2
+                    newTable2[val2] |= 1 << val1
+
+        self._update_binary_factor_table(var1, var2, newTable1)
+        self._update_binary_factor_table(var2, var1, newTable2)
+
+    def add_not_equal_factor(self, var1, var2):
+        """
+        Register the common 'not equal' binary factor between var1 and
+        var2. Since the factor is a constant, no compatibility table is
+        built: the table entry None stands for the implicit val1 != val2,
+        which the solver specializes to a single precomputed mask.
+        """
+        if var1 == var2:
+            raise Exception(
+                f"Error: trying to add a binary factor with the same "
+                f"variable {var1}")
+
+        self._update_not_equal_table(var1, var2)
+        self._update_not_equal_table(var2, var1)
+
+    def _update_not_equal_table(self, var1, var2):
+        """
+        Internal helper function.
+        Registers the implicit 'not equal' factor for the ordered pair
+        (var1, var2). A no-op if the pair already carries it; merged into
+        an explicit compatibility table if one exists.
+        """
+        if var2 not in self.binaryFactors[var1]:
+            self.binaryFactors[var1][var2] = None
+        else:
+            table = self.binaryFactors[var1][var2]
+            if table is not None:
+                for val in range(len(table)):
+                    table[val] &= ~(1 << val)
+
+    def add_unit(self, variables):
+        """
+        Register a unit: a group of variables that must take pairwise
+        different values. A value that is possible in only one of the
+        unit's variables must be assigned there (a 'hidden single'),
+        which the solver exploits during propagation.
+        """
+        self.units.append(tuple(variables))
+
+    def _update_binary_factor_table(self, var1, var2, table):
+        """
+        Internal helper function.
+        Updates the binary compatibility table according to the new factor
+        function. If variables already 'neighbors', merge the new factor by
+        intersecting the compatibility masks.
+        """
+
+        if var2 not in self.binaryFactors[var1]:
+            self.binaryFactors[var1][var2] = table
+
+        else:
+            oldTable = self.binaryFactors[var1][var2]
+            if oldTable is None:
+                # materialize the implicit 'not equal' factor to merge
+                # with the explicit table
+                oldTable = [~(1 << val) & ((1 << len(table)) - 1)
+                            for val in range(len(table))]
+                self.binaryFactors[var1][var2] = oldTable
+            assert len(oldTable) == len(table)
+            for v1 in range(len(table)):
+                oldTable[v1] &= table[v1]
+
+##############################################################################
+class Backtracking:
+    """
+    A backtracking algorithm for solving weighted CSP.
+    Using Most Constraint Variable (MCV) heuristic and/or Arc Consistency
+    enforcement (AC3 algorithm) as option.
+
+    Usage:
+    alg = Backtracking()
+    alg.solve(mcv=True, ac3=True)
+    alg.print_stats()
+
+    optimalAssignment = alg.optimalAssignment
+    """
+    def reset_results(self):
+        """
+        Keep track of various statistics of the CSP solver.
+        Kind of __init__(), but can be 'recalled' to enable repeated solver
+        calls.
+        """
+        self.numOptimalAssignments = 0
+        self.optimalWeight = 0
+        self.optimalAssignment = {}
+
+        self.numAssignments = 0
+
+        # keep track of number of calls to self.backtrack() to compare
+        # complexity when using mcv/ac3.
+        self.numOperations = 0
+
+        self.firstAssignmentNumOperations = 0
+
+    def print_stats(self):
+
+        if self.optimalAssignment:
+            print(f"Found {self.numOptimalAssignments} optimal assignments "
+                  f"with weight {self.optimalWeight} in {self.numOperations} "
+                  f"operations")
+            print(f"First assignment took "
+                  f"{self.firstAssignmentNumOperations} operations")
+        else:
+            print("No solution was found")
+
+    def solve(self, csp, mcv=True, ac3=True):
+        """
+        Solves the given weighted CSP using optional heuristics (mcv / ac3).
+        This function will keep searching for satisfied assignments (for
+        enabling the 'weighted CSP'.
+        Results are stored the initialization (/reset_results) variables.
+
+        :param csp: A weighted CSP
+        :param mcv: True for using the Most Constraint Variable heuristic.
+        :param ac3: True for applying arc-consistency (AC-3).
+        """
+        self.csp = csp
+        self.mcv = mcv
+        self.ac3 = ac3
+        self.reset_results()
+
+        # flat structure-of-arrays layout: variables become dense int
+        # indices into plain lists, so the hot loops index lists with small
+        # ints instead of hashing tuple variable names. (This is also the
+        # layout a JIT / C port of the solver would require.)
+        self.varNames = list(csp.variables)
+        self.varIndex = csp.varIndex
+        self.numVars = csp.numVariables
+
+        self.domains = [csp.values[var] for var in self.varNames]
+        self.values = list(self.domains)
+        self.unary = [csp.unaryFactors.get(var) for var in self.varNames]
+
+        # prune values with a zero unary weight upfront -- they can never
+        # be assigned, and removing them keeps the domain popcount an exact
+        # count of the assignable values (used by the MCV heuristic)
+        for var, factor in csp.unaryFactors.items():
+            mask = 0
+            for val, w in factor.items():
+                if w != 0:
+                    mask |= 1 << val
+            self.domains[self.varIndex[var]] &= mask
+
+        # precomputed neighbor index tuples with their compatibility
+        # tables, and a per-variable bitmask of the values forbidden by the
+        # assigned neighbors (maintained incrementally in backtrack).
+        # 'not equal' factors are registered as None; substitute a single
+        # shared precomputed table so the hot loops need no special casing
+        maxBits = max(self.values, default=0).bit_length()
+        neqTable = [~(1 << val) for val in range(maxBits)]
+        self.neighbors = [tuple(self.varIndex[var2]
+                                for var2 in csp.binaryFactors[var])
+                          for var in self.varNames]
+        self.factors = [{self.varIndex[var2]:
+                         table if table is not None else neqTable
+                         for var2, table in csp.binaryFactors[var].items()}
+                        for var in self.varNames]
+        self.forbidden = [0] * self.numVars
+
+        # units (all-different variable groups) for hidden-single
+        # propagation, as index tuples
+        self.units = [tuple(self.varIndex[var2] for var2 in unit)
+                      for unit in csp.units]
+
+        # the running assignment is a flat array indexed by variable
+        # index; None marks an unassigned variable
+        self.assignment = [None] * self.numVars
+
+        if self.ac3:
+            # propagate the initial clues once before searching: AC-3
+            # from every pinned (singleton) domain, then hidden singles.
+            # Easy puzzles largely collapse here, before any branching.
+            # The reductions are sound, so the trail is discarded.
+            for var in range(self.numVars):
+                domain = self.domains[var]
+                if domain and (domain & (domain - 1)) == 0:
+                    self.arc_consistency(var)
+            self.unit_propagate()
+
+        self.backtrack(0, 1)
+
+    def backtrack(self, numAssigned, weight):
+        """
+        Preforming the backtracking algorithm to find all valid assignments
+        to the factor graph (weigted CSP).
+
+        The current assignment lives in self.assignment, a flat array
+        indexed by variable index with None marking unassigned variables.
+
+        :param numAssigned: Number of variables assigned so far.
+        :param weight: The weight of the given assignment. Multiplied by
+        the marginal weight of each new value (its unary weight, or zero
+        if the value is forbidden by an assigned neighbor).
+        :return:
+        """
+        self.numOperations += 1
+
+        # first, handle complete assignment
+        if numAssigned == self.numVars:
+            # final assignment
+            self.numAssignments += 1
+
+            # update statistics, materializing the assignment dict
+            # (translated back to the variable names) only when it improves
+            # on the best weight seen so far
+            if self.numOptimalAssignments == 0 or weight > self.optimalWeight:
+                if weight == self.optimalWeight:
+                    self.numOptimalAssignments += 1
+                else:
+                    self.numOptimalAssignments = 1
+                self.optimalWeight = weight
+
+                self.optimalAssignment = {var: self.assignment[k]
+                                          for k, var in
+                                          enumerate(self.varNames)}
+                if self.firstAssignmentNumOperations == 0:
+                    self.firstAssignmentNumOperations = self.numOperations
+
+            return
+
+        # if partial assignment, get next variable. The first unassigned if
+        # mcv is disables.
+        var = self.get_unassigned_variable()
+        values = self.domains[var]
+
+        # hoist the attribute chains out of the per-value loop
+        domains = self.domains
+        forbidden = self.forbidden
+        assignment = self.assignment
+        varFactors = self.factors[var]
+        varNeighbors = self.neighbors[var]
+        fullValues = self.values
+        unary = self.unary[var]
+
+        # iterate the candidate values with the inlined lowest-bit trick;
+        # the marginal weight of a value is its unary weight (1.0 when
+        # there is none) and zero when an assigned neighbor forbids it
+        mask = values
+        while mask:
+            lowest = mask & -mask
+            mask &= mask - 1
+            val = lowest.bit_length() - 1
+
+            if (forbidden[var] >> val) & 1:
+                continue
+            deltaWeight = 1.0 if unary is None else unary[val]
+            if deltaWeight > 0:
+                assignment[var] = val
+
+                # mark the values incompatible with var=val as forbidden
+                # for var's unassigned neighbors (the masks of assigned
+                # neighbors are never consulted), recording only the newly
+                # forbidden bits so the undo below is exact
+                forbid = []
+                for var2 in varNeighbors:
+                    if assignment[var2] is not None:
+                        continue
+                    newly = (fullValues[var2]
+                             & ~varFactors[var2][val]
+                             & ~forbidden[var2])
+                    if newly:
+                        forbidden[var2] |= newly
+                        forbid.append((var2, newly))
+
+                if self.ac3:
+                    # perform arc-consistency check
+
+                    # instead of copying all domains, keep a trail (undo
+                    # log) of the bits removed from each domain, starting
+                    # with the temporary update of variable var to the
+                    # proposed value val
+                    trail = [(var, domains[var] & ~(1 << val))]
+                    domains[var] = 1 << val
+
+                    # enforce arc-consistency on neighbors (and their
+                    # neighbors, etc (updating self.domains in the process,
+                    # hopefully shrinking number of possible values to
+                    # unassigned variables. Then propagate hidden singles
+                    # over the registered units.
+                    trail += self.arc_consistency(var)
+                    trail += self.unit_propagate()
+
+                    # recursively call backtrack on possible children
+                    self.backtrack(numAssigned + 1, weight * deltaWeight)
+
+                    # restore unassigned variables' domain by replaying the
+                    # trail in reverse
+                    for var2, removed in reversed(trail):
+                        domains[var2] |= removed
+
+                else:
+                    # arc consistency is disabled
+                    self.backtrack(numAssigned + 1, weight * deltaWeight)
+
+                for var2, newly in forbid:
+                    forbidden[var2] &= ~newly
+                assignment[var] = None
+
+    def get_unassigned_variable(self):
+        """
+        Given the current partial assignment (self.assignment), return a
+        variable to be assigned next.
+
+        In case of mcv enabled (=True), count number of possible valid values
+        of each of the variables (among those that are consistent with
+        current assignment-- weight>0) and return the variable with the
+        least number of these values. The count is the popcount of the
+        domain minus the values forbidden by assigned neighbors -- AC-3 and
+        the forbidden masks already did the consistency work, so no
+        per-value weight evaluation is needed.
+        """
+        # hoist the attribute lookups out of the per-variable scan
+        assignment = self.assignment
+        if self.mcv:
+            domains = self.domains
+            forbidden = self.forbidden
+            # streaming min over a generator -- no (count, var) list is
+            # materialized per backtrack node
+            return min((var for var in range(self.numVars)
+                        if assignment[var] is None),
+                       key=lambda var: (domains[var]
+                                        & ~forbidden[var]).bit_count())
+
+        else:
+            for var in range(self.numVars):
+                if assignment[var] is None:
+                    return var
+
+    def arc_consistency(self, var):
+        """
+        Apply arc consistency on the neighbors of variable var.
+        Note variable var is already assigned a value.
+
+        Using a queue of arcs (var2, var1), each arc revises the domain of
+        var2 against the domain of var1; whenever a domain shrinks, only
+        the arcs pointing at the shrunken variable are re-queued.
+
+        Returns a trail: a list of (variable, bitmask of removed values)
+        entries, so the caller can undo the domain reductions.
+        """
+        # hoist the attribute chains out of the revision loop
+        domains = self.domains
+        factors = self.factors
+        neighbors = self.neighbors
+
+        trail = []
+        # seed the queue with the arcs pointing at the updated variable
+        queue = deque((var2, var) for var2 in neighbors[var])
+        popleft = queue.popleft
+        push = queue.append
+
+        while queue:
+            var2, var1 = popleft()
+
+            inconsistent = 0
+            factor = factors[var2][var1]
+            support = domains[var1]
+            # iterate the values of var2's domain with the inlined
+            # lowest-bit trick; val2 has a support iff some value in
+            # var1's domain is compatible with it -- a single mask
+            # intersection. Inconsistent values are collected as a
+            # bitmask and removed together below.
+            mask = domains[var2]
+            while mask:
+                lowest = mask & -mask
+                mask &= mask - 1
+                if not factor[lowest.bit_length() - 1] & support:
+                    inconsistent |= lowest
+
+            if inconsistent:
+                # remove inconsistent values from domain and record the
+                # removal on the trail
+                domains[var2] &= ~inconsistent
+                trail.append((var2, inconsistent))
+
+                # since the domain of var2 has changed, re-queue the arcs
+                # pointing at var2 for further exploration of consistency
+                # changes
+                for var3 in neighbors[var2]:
+                    if var3 != var1:
+                        push((var3, var2))
+
+        return trail
+
+    def unit_propagate(self):
+        """
+        Apply hidden-single propagation on the registered units: a value
+        that is possible in exactly one variable of a unit must be
+        assigned there, so that variable's domain collapses to it.
+        Each collapse is followed by an arc-consistency pass, and units
+        are re-scanned until a fixed point is reached.
+
+        Returns a trail of (variable, bitmask of removed values) entries,
+        like arc_consistency.
+        """
+        # hoist the attribute lookups out of the unit scans
+        domains = self.domains
+        units = self.units
+        arc_consistency = self.arc_consistency
+
+        trail = []
+        changed = True
+
+        while changed:
+            changed = False
+            for unit in units:
+                # 'once' accumulates the values seen in the unit, 'twice'
+                # those seen in more than one domain; the difference is
+                # the values possible in exactly one variable
+                once = 0
+                twice = 0
+                for var in unit:
+                    domain = domains[var]
+                    twice |= once & domain
+                    once |= domain
+                singles = once & ~twice
+                if not singles:
+                    continue
+
+                for var in unit:
+                    domain = domains[var]
+                    forced = domain & singles
+                    if forced and forced != domain:
+                        if forced & (forced - 1):
+                            # two different values are forced into the
+                            # same variable -- dead end, empty the domain
+                            forced = 0
+                        domains[var] = forced
+                        trail.append((var, domain & ~forced))
+                        if forced:
+                            trail += arc_consistency(var)
+                        changed = True
+
+        return trail
+